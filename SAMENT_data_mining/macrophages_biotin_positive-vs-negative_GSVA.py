@@ -2,6 +2,10 @@
 # coding: utf-8
 
 # In[3]:
+import base64
+import io
+import json
+import math
 import streamlit as st
 import pandas as pd
 import numpy as np
@@ -9,6 +13,9 @@ import plotly.graph_objects as go
 import os
 from plotly.io import to_image
 
+# Significance threshold on the -log10(adj.P.Val) axis
+LOG10_05 = -math.log10(0.05)
+
 # Check if kaleido is installed for image export
 try:
     import kaleido
@@ -16,91 +23,223 @@ try:
 except ImportError:
     kaleido_available = False
 
-# Load the data (Cached for performance)
-@st.cache_data
+# Check if numba is installed for the JIT categorization kernel
+try:
+    import numba
+    numba_available = True
+except ImportError:
+    numba_available = False
+
+# Check if datashader is installed for rasterizing the background cloud
+try:
+    import datashader as ds
+    import datashader.transfer_functions as tf
+    datashader_available = True
+except ImportError:
+    datashader_available = False
+
+# Only rasterize the non-significant cloud when it is big enough to slow Plotly down
+RASTERIZE_THRESHOLD = 5000
+
+# Load the data (Cached for performance; persisted so restarts skip the parse)
+@st.cache_data(persist='disk', max_entries=1)
 def load_data():
     dir_path = os.path.dirname(os.path.realpath(__file__))
     file_path = os.path.join(dir_path, 'macrophages_biotin_positive-vs-negative_GSVA.csv')
-    
-    if not os.path.exists(file_path):
-        st.error(f"File {file_path} not found. Please check the file path.")
-        return None
-    
-    df = pd.read_csv(file_path)
-    df = df.set_index(df.columns[0])
-    df.index = df.index.str.strip()
-    df['-log10(adj.P.Val)'] = -np.log10(df['P.Value'])
+    parquet_path = file_path.replace('.csv', '.parquet')
+
+    # Serve the parquet cache only while it is at least as new as the CSV
+    if os.path.exists(parquet_path) and os.path.exists(file_path) \
+            and os.path.getmtime(parquet_path) >= os.path.getmtime(file_path):
+        df = pd.read_parquet(parquet_path)
+    else:
+        if not os.path.exists(file_path):
+            st.error(f"File {file_path} not found. Please check the file path.")
+            return None
+
+        df = pd.read_csv(file_path)
+        df = df.set_index(df.columns[0])
+        df.index = df.index.str.strip()
+        # float32 is plenty for plotting and threshold tests; halves memory traffic
+        df[['GSVA_score', 'P.Value', 'adj.P.Val']] = df[['GSVA_score', 'P.Value', 'adj.P.Val']].astype(np.float32)
+        log_p = np.log10(df['adj.P.Val'].to_numpy(), dtype=np.float32)
+        np.negative(log_p, out=log_p)
+        df['-log10(adj.P.Val)'] = log_p
+        df['upper_index'] = df.index.str.replace('_', ' ', regex=False).str.upper()
+        try:
+            df.to_parquet(parquet_path, compression='zstd')
+        except (ImportError, OSError):
+            pass  # Parquet cache is optional; fall back to reparsing the CSV next time
+
+    # Cache the normalized pathway names once so keyword matching stays vectorized
+    df.attrs['upper_index'] = df['upper_index']
     return df
 
 df = load_data()
 
-# Function to categorize pathways
-def get_category(row, keywords=[], logic='AND'):
-    pathway_name = row.name.replace('_', ' ').upper()
+# Category labels, indexed by the int8 codes returned by get_category
+CATEGORIES = ['non-significant', 'upregulated', 'downregulated', 'keyword_match']
+
+# Static styling, built once instead of on every rerun
+PALETTE = {'keyword_match': '#32CD32', 'upregulated': '#FF6347', 'downregulated': '#1E90FF', 'non-significant': '#A9A9A9'}
+MARKER_STYLE = {cat: dict(size=15 if cat == 'keyword_match' else 8, color=PALETTE[cat], opacity=0.8, line=dict(width=0.5, color='black'))
+                for cat in CATEGORIES}
+BASE_LAYOUT = dict(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(255,255,255,1)', title='Macrophage: Biotin Positive vs Negative',
+                   xaxis_title='GSVA Score', yaxis_title='-log10(adj.P.Val)', title_font_size=18,
+                   legend_title_text='Pathway Categories', autosize=True)
+
+if numba_available:
+    # Single-pass kernel over the raw arrays; kw_hits holds one precomputed
+    # str.contains column per keyword. Keyword matches take priority, same as
+    # the vectorized path below.
+    @numba.njit(cache=True)
+    def _categorize_jit(gsva, logp, kw_hits, logic_and):
+        n, k = kw_hits.shape
+        codes = np.zeros(n, dtype=np.int8)
+        for i in range(n):
+            if logic_and:
+                matched = True
+                for j in range(k):
+                    if not kw_hits[i, j]:
+                        matched = False
+                        break
+            else:
+                matched = False
+                for j in range(k):
+                    if kw_hits[i, j]:
+                        matched = True
+                        break
+            if matched:
+                codes[i] = 3
+            elif logp[i] > LOG10_05:
+                if gsva[i] > 0.5:
+                    codes[i] = 1
+                elif gsva[i] < -0.5:
+                    codes[i] = 2
+        return codes
+
+# Rasterize the non-significant cloud into a PNG data URI spanning the axis ranges
+def _rasterize_background(xs, ys, x_range, y_range, plot_width=800, plot_height=640):
+    canvas = ds.Canvas(plot_width=plot_width, plot_height=plot_height, x_range=x_range, y_range=y_range)
+    agg = canvas.points(pd.DataFrame({'x': xs, 'y': ys}), 'x', 'y')
+    img = tf.shade(agg, cmap=[PALETTE['non-significant']])
+    buf = io.BytesIO()
+    img.to_pil().save(buf, format='png')
+    return 'data:image/png;base64,' + base64.b64encode(buf.getvalue()).decode()
+
+# Function to categorize pathways (vectorized over the whole DataFrame)
+def get_category(df, keywords=[], logic='AND'):
+    gsva = df['GSVA_score'].to_numpy()
+    logp = df['-log10(adj.P.Val)'].to_numpy()
+
     keywords = [kw.upper().strip() for kw in keywords if kw.strip() != '']
-    
+    upper_index = df.attrs.get('upper_index')
+    if upper_index is None:
+        upper_index = df.index.str.replace('_', ' ', regex=False).str.upper()
+    masks = [np.asarray(upper_index.str.contains(kw, regex=False)) for kw in keywords]
+
+    if numba_available and logic in ('AND', 'OR'):
+        kw_hits = np.column_stack(masks) if masks else np.zeros((len(df), 0), dtype=bool)
+        return _categorize_jit(gsva, logp, kw_hits, logic == 'AND')
+
+    significant = logp > LOG10_05
+    codes = np.zeros(len(df), dtype=np.int8)
+    codes[significant & (gsva < -0.5)] = 2
+    codes[significant & (gsva > 0.5)] = 1
     if logic == 'AND':
-        if all(keyword in pathway_name for keyword in keywords):
-            return 'keyword_match'
+        matched = np.logical_and.reduce(masks) if masks else np.ones(len(df), dtype=bool)
     elif logic == 'OR':
-        if any(keyword in pathway_name for keyword in keywords):
-            return 'keyword_match'
-    
-    if row['GSVA_score'] > 0.5 and row['-log10(adj.P.Val)'] > -np.log10(0.05):
-        return 'upregulated'
-    elif row['GSVA_score'] < -0.5 and row['-log10(adj.P.Val)'] > -np.log10(0.05):
-        return 'downregulated'
+        matched = np.logical_or.reduce(masks) if masks else np.zeros(len(df), dtype=bool)
     else:
-        return 'non-significant'
+        matched = np.zeros(len(df), dtype=bool)
+    codes[matched] = 3
+
+    return codes
+
+# Function to update the plot (memoized; df is always the single dataset from
+# load_data, so it hashes to a constant and the other arguments key the cache)
+@st.cache_data(max_entries=32, hash_funcs={pd.DataFrame: lambda _: 0})
+def update_plot(df, keywords=(), logic='AND', width='100%', height=800, interactive=True):
+    codes = get_category(df, keywords=keywords, logic=logic)
+    df['category'] = pd.Categorical.from_codes(codes, categories=CATEGORIES)
+
+    # Single categorization pass: gather each group from the raw arrays instead of
+    # materializing four filtered DataFrames
+    # Round to 4 decimals: invisible on screen, but roughly halves the JSON payload
+    x = np.round(df['GSVA_score'].to_numpy(), 4)
+    y = np.round(df['-log10(adj.P.Val)'].to_numpy(), 4)
+    idx = df.index.to_numpy()
+
+    # Accumulate traces as plain dicts and validate the figure once at construction
+    traces = []
+
+    # Plot non-significant pathways; rasterize the cloud below the axes when it
+    # is large, so only the colored groups ship to the browser as real points
+    sel = np.flatnonzero(codes == 0)
+    background = None
+    if datashader_available and len(sel) >= RASTERIZE_THRESHOLD:
+        x_range = (float(x.min()), float(x.max()))
+        y_range = (float(y.min()), float(y.max()))
+        background = _rasterize_background(x[sel], y[sel], x_range, y_range)
+        # Empty stub keeps the legend entry for the rasterized cloud
+        traces.append(dict(type='scattergl', x=[], y=[], mode='markers',
+                           marker=MARKER_STYLE['non-significant'], name='Non-Significant'))
+    else:
+        traces.append(dict(type='scattergl', x=x[sel], y=y[sel], mode='markers',
+                           marker=MARKER_STYLE['non-significant'],
+                           text=list(idx[sel]), hoverinfo='text', name='Non-Significant'))
 
-# Function to update the plot
-def update_plot(keywords=[], logic='AND', width='100%', height=800, interactive=True):
-    df['category'] = df.apply(get_category, axis=1, keywords=keywords, logic=logic)
-    palette = {'keyword_match': '#32CD32', 'upregulated': '#FF6347', 'downregulated': '#1E90FF', 'non-significant': '#A9A9A9'}
-    fig = go.Figure()
-    
-    # Plot non-significant pathways
-    non_significant_df = df[df['category'] == 'non-significant']
-    fig.add_trace(go.Scatter(x=non_significant_df['GSVA_score'], y=non_significant_df['-log10(adj.P.Val)'], mode='markers',
-                             marker=dict(size=8, color=palette['non-significant'], opacity=0.8, line=dict(width=0.5, color='black')),
-                             text=[name for name in non_significant_df.index], hoverinfo='text', name='Non-Significant'))
-    
     # Plot up-regulated pathways
-    upregulated_df = df[df['category'] == 'upregulated']
-    fig.add_trace(go.Scatter(x=upregulated_df['GSVA_score'], y=upregulated_df['-log10(adj.P.Val)'], mode='markers',
-                             marker=dict(size=8, color=palette['upregulated'], opacity=0.8, line=dict(width=0.5, color='black')),
-                             text=[f'<span style="color:{palette["upregulated"]};">{name}</span>' for name in upregulated_df.index], hoverinfo='text', name='Up-regulated'))
+    sel = np.flatnonzero(codes == 1)
+    traces.append(dict(type='scattergl', x=x[sel], y=y[sel], mode='markers',
+                       marker=MARKER_STYLE['upregulated'],
+                       text=list(idx[sel]), hoverinfo='text', hoverlabel=dict(font=dict(color=PALETTE['upregulated'])), name='Up-regulated'))
 
     # Plot down-regulated pathways
-    downregulated_df = df[df['category'] == 'downregulated']
-    fig.add_trace(go.Scatter(x=downregulated_df['GSVA_score'], y=downregulated_df['-log10(adj.P.Val)'], mode='markers',
-                             marker=dict(size=8, color=palette['downregulated'], opacity=0.8, line=dict(width=0.5, color='black')),
-                             text=[f'<span style="color:{palette["downregulated"]};">{name}</span>' for name in downregulated_df.index], hoverinfo='text', name='Down-regulated'))
-    
-    # Sort keyword-matched pathways by P.Value
-    keyword_df = df[df['category'] == 'keyword_match'].sort_values('P.Value')
-    
+    sel = np.flatnonzero(codes == 2)
+    traces.append(dict(type='scattergl', x=x[sel], y=y[sel], mode='markers',
+                       marker=MARKER_STYLE['downregulated'],
+                       text=list(idx[sel]), hoverinfo='text', hoverlabel=dict(font=dict(color=PALETTE['downregulated'])), name='Down-regulated'))
+
+    # Sort keyword-matched pathways by P.Value via argsort on the raw array
+    kw_sel = np.flatnonzero(codes == 3)
+    kw_sel = kw_sel[np.argsort(df['P.Value'].to_numpy()[kw_sel], kind='stable')]
+    keyword_df = df.iloc[kw_sel]
+
     if interactive:
         # Plot keyword-matched pathways interactively
-        fig.add_trace(go.Scatter(x=keyword_df['GSVA_score'], y=keyword_df['-log10(adj.P.Val)'], mode='markers',
-                                 marker=dict(size=15, color=palette['keyword_match'], opacity=0.8, line=dict(width=0.5, color='black')),
-                                 text=[f'<span style="color:{palette["keyword_match"]};">{name}</span>' for name in keyword_df.index], hoverinfo='text', name=', '.join(keywords)))
+        traces.append(dict(type='scattergl', x=x[kw_sel], y=y[kw_sel], mode='markers',
+                           marker=MARKER_STYLE['keyword_match'],
+                           text=list(idx[kw_sel]), hoverinfo='text', hoverlabel=dict(font=dict(color=PALETTE['keyword_match'])), name=', '.join(keywords)))
     else:
-        # Plot numbered keyword-matched pathways
-        for i, (index, row) in enumerate(keyword_df.iterrows()):
-            showlegend = i == 0  # Only show legend for the first trace
-            fig.add_trace(go.Scatter(x=[row['GSVA_score']], y=[row['-log10(adj.P.Val)']], mode='text+markers',
-                                     marker=dict(size=15, color=palette['keyword_match'], opacity=0.8, line=dict(width=0.5, color='black')),
-                                     text=f"<b style='color:black;'>{i+1}</b>",  # Bold and black color for numbers
-                                     hoverinfo='text', name=f"{', '.join(keywords)}" if showlegend else None, showlegend=showlegend))
-
-    # Set layout
-    fig.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(255,255,255,1)', title='Macrophage: Biotin Positive vs Negative',
-                      xaxis_title='GSVA Score', yaxis_title='-log10(adj.P.Val)', title_font_size=18, width=width, height=height,
-                      legend_title_text='Pathway Categories', autosize=True)
-    
+        # Plot numbered keyword-matched pathways in a single trace
+        traces.append(dict(type='scatter', x=x[kw_sel], y=y[kw_sel], mode='markers+text',
+                           marker=MARKER_STYLE['keyword_match'],
+                           text=[f"<b>{i+1}</b>" for i in range(len(kw_sel))], textposition='top center',
+                           textfont=dict(color='black'), hoverinfo='text', name=', '.join(keywords)))
+
+    # Build the figure in one shot: traces plus layout, one validation pass
+    layout = {**BASE_LAYOUT, 'width': width, 'height': height}
+    if background is not None:
+        layout['images'] = [dict(source=background, xref='x', yref='y', x=x_range[0], y=y_range[1],
+                                 sizex=x_range[1] - x_range[0], sizey=y_range[1] - y_range[0],
+                                 sizing='stretch', layer='below')]
+        # Pin the axes to the full data extent; otherwise Plotly autoranges to the
+        # colored traces only and clips the rasterized cloud
+        x_pad = 0.03 * (x_range[1] - x_range[0])
+        y_pad = 0.03 * (y_range[1] - y_range[0])
+        layout['xaxis_range'] = [x_range[0] - x_pad, x_range[1] + x_pad]
+        layout['yaxis_range'] = [y_range[0] - y_pad, y_range[1] + y_pad]
+    fig = go.Figure(data=traces, layout=layout)
+
     return fig, keyword_df
 
+# Render the figure to image bytes (memoized; Kaleido spins up a headless
+# browser per call, so repeated downloads of the same figure are served from cache)
+@st.cache_data(show_spinner=False)
+def render_image(fig_json, fmt, scale=3):
+    return to_image(json.loads(fig_json), format=fmt, engine="kaleido", scale=scale)
+
 if df is not None:
     # Sidebar input for keywords and logic
     st.sidebar.header('Search Parameters')
@@ -113,7 +252,7 @@ if df is not None:
     interactive_keywords = st.sidebar.radio('Keyword-Matched Pathways Interactive?', ('Yes', 'No'))
     
     # Update plot based on user input
-    fig, keyword_df = update_plot(keywords, logic, width=fig_width, height=fig_height, interactive=(interactive_keywords == 'Yes'))
+    fig, keyword_df = update_plot(df, tuple(sorted(keywords)), logic, width=fig_width, height=fig_height, interactive=(interactive_keywords == 'Yes'))
     
     # Display plot
     st.plotly_chart(fig, use_container_width=True)
@@ -135,10 +274,10 @@ if df is not None:
     if st.sidebar.button('Download'):
         if kaleido_available:
             if download_format == 'PNG':
-                file_bytes = to_image(fig, format='png', engine="kaleido", scale=3)  # 300 DPI
+                file_bytes = render_image(fig.to_json(), 'png')  # 300 DPI
                 st.sidebar.download_button(label='Download as PNG', data=file_bytes, file_name='plot.png', mime='image/png')
             elif download_format == 'PDF':
-                file_bytes = to_image(fig, format='pdf', engine="kaleido", scale=3)  # 300 DPI
+                file_bytes = render_image(fig.to_json(), 'pdf')  # 300 DPI
                 st.sidebar.download_button(label='Download as PDF', data=file_bytes, file_name='plot.pdf', mime='application/pdf')
         else:
             st.sidebar.error("Image export requires the 'kaleido' package. Please install it by adding 'kaleido' to your requirements.txt file.")